@@ -1,6 +1,96 @@
-from typing import Dict
-from cryptography.fernet import Fernet
+from typing import Dict, Tuple, Union
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import atexit
+import base64
+import ctypes
 import hashlib
+import os
+import queue
+import threading
+
+def shred_buffer(buf: bytearray):
+    """
+    Zera o conteúdo de um buffer mutável in-place (Crypto-Shredding de memória).
+    `del` apenas decrementa o refcount; os bytes continuariam no heap.
+    """
+    if buf:
+        ctypes.memset((ctypes.c_char * len(buf)).from_buffer(buf), 0, len(buf))
+
+def b64_default(obj):
+    """
+    `default=` para orjson: codifica campos binários (ciphertext, nonce) em base64
+    apenas na borda, ao serializar a resposta.
+    """
+    if isinstance(obj, (bytes, bytearray)):
+        return base64.b64encode(obj).decode('ascii')
+    raise TypeError
+
+# Tamanho do pool de DEKs pré-geradas
+DEK_POOL_SIZE = 64
+
+# Pool único de DEKs do processo, compartilhado por todas as instâncias de UmbrellaKMS
+# e abastecido por um único thread em background, iniciado no primeiro uso.
+_dek_pool = queue.Queue(maxsize=DEK_POOL_SIZE)
+_dek_refill_thread = None
+_dek_refill_lock = threading.Lock()
+_dek_refill_stop = threading.Event()
+
+def _new_dek() -> Tuple[str, bytearray]:
+    # 1. Gerar DEK (Data Encryption Key) efêmera
+    # Na arquitetura completa, esta chave seria gerada pelo KMS e entregue aqui.
+    key = bytearray(AESGCM.generate_key(bit_length=128))
+    
+    # O ID da chave é um hash dela mesma ou um UUID gerado pelo KMS.
+    key_id = hashlib.sha256(key).hexdigest()[:16]
+    return key_id, key
+
+def _refill_dek_pool():
+    while not _dek_refill_stop.is_set():
+        dek = _new_dek()
+        while True:
+            try:
+                _dek_pool.put(dek, timeout=0.1)
+                break
+            except queue.Full:
+                if _dek_refill_stop.is_set():
+                    shred_buffer(dek[1])
+                    return
+
+def _take_dek() -> Tuple[str, bytearray]:
+    global _dek_refill_thread
+    if _dek_refill_thread is None:
+        with _dek_refill_lock:
+            if _dek_refill_thread is None:
+                _dek_refill_stop.clear()
+                _dek_refill_thread = threading.Thread(
+                    target=_refill_dek_pool, name="umbrella-dek-refill", daemon=True
+                )
+                _dek_refill_thread.start()
+    try:
+        return _dek_pool.get_nowait()
+    except queue.Empty:
+        # Pool vazio (arranque ou rajada): gera inline
+        return _new_dek()
+
+def stop_dek_pool():
+    """
+    Para o thread de refill e zera as DEKs que ainda estão na fila (registrado no atexit).
+    Um uso posterior de encrypt_payload reinicia o pool.
+    """
+    global _dek_refill_thread
+    with _dek_refill_lock:
+        thread, _dek_refill_thread = _dek_refill_thread, None
+        if thread is not None:
+            _dek_refill_stop.set()
+            thread.join()
+        while True:
+            try:
+                _, key = _dek_pool.get_nowait()
+            except queue.Empty:
+                break
+            shred_buffer(key)
+
+atexit.register(stop_dek_pool)
 
 class UmbrellaKMS:
     """
@@ -8,28 +98,43 @@ class UmbrellaKMS:
     sem ser transformado em Ciphertext.
     Ref: AI_RULES.md - Section 2.C
     """
-    def encrypt_payload(self, plaintext: str) -> Dict[str, str]:
-        # Implementação REAL com criptografia simétrica (Fernet/AES-128-CBC)
+    def encrypt_payload(self, plaintext: Union[str, bytes, bytearray]) -> Dict[str, Union[str, bytes]]:
+        # Implementação REAL com criptografia autenticada (AES-128-GCM)
         # O conceito fundamental é o Desacoplamento Criptográfico.
+        # AESGCM chama o AEAD do OpenSSL direto, sem o enquadramento
+        # (timestamp + HMAC) que o Fernet monta em Python.
         
-        # 1. Gerar DEK (Data Encryption Key) efêmera
-        # Na arquitetura completa, esta chave seria gerada pelo KMS e entregue aqui.
-        key = Fernet.generate_key()
-        f = Fernet(key)
-        
-        # O ID da chave é um hash dela mesma ou um UUID gerado pelo KMS.
-        key_id = hashlib.sha256(key).hexdigest()[:16]
+        # 1. Obter DEK (Data Encryption Key) efêmera do pool; cada chave é usada uma única vez.
+        # A geração da chave e do key_id sai do caminho da requisição.
+        key_id, key = _take_dek()
         
-        # 2. Encrypt (AES real)
-        token_bytes = f.encrypt(plaintext.encode('utf-8'))
-        ciphertext = token_bytes.decode('utf-8')
+        # 2. Encrypt (AES real). Nonce de 96 bits, único por chave.
+        # GCM passa direto pela EVP do OpenSSL (AES-NI + PCLMULQDQ); o nonce
+        # segue em campo próprio para evitar concatenar buffers.
+        # Texto vindo como str é copiado para um bytearray próprio, que é zerado ao final;
+        # buffers recebidos do chamador são zerados pelo próprio chamador.
+        data = bytearray(plaintext.encode('utf-8')) if isinstance(plaintext, str) else plaintext
+        nonce = os.urandom(12)
+        try:
+            token_bytes = AESGCM(key).encrypt(nonce, data, None)
+        finally:
+            # NOTA DE SEGURANÇA:
+            # A chave 'key' (KEK/DEK) DEVERIA ser enviada para o KMS (Umbrella); aqui é zerada
+            # só depois do encrypt: algumas versões do AESGCM guardam a referência ao buffer
+            # e só leem a chave dentro de encrypt().
+            shred_buffer(key)
+            if data is not plaintext:
+                shred_buffer(data)
         
-        # NOTA DE SEGURANÇA:
-        # A chave 'key' (KEK/DEK) DEVERIA ser enviada para o KMS (Umbrella) e deletada da memória imediatamente.
+        # Ciphertext e nonce saem como bytes crus; o base64 fica para a camada de resposta.
+        # O hash de auditoria é calculado aqui, com o ciphertext ainda quente em cache,
+        # para o chamador não precisar de uma segunda passada sobre o buffer.
         return {
             "key_id": key_id,
-            "ciphertext": ciphertext,
-            "algo": "Fernet (AES-128-CBC)"
+            "nonce": nonce,
+            "ciphertext": token_bytes,
+            "audit_hash": hashlib.sha256(token_bytes).hexdigest(),
+            "algo": "AES-128-GCM"
         }
 
     def shred_key(self, key_id: str):
@@ -1,21 +1,43 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+import functools
+import json
+import orjson
 import sys
 import os
 
 # Add server directory to path to handle imports if run directly
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from core.umbrella import UmbrellaKMS
-from pipeline.stage4_veritas.veritas_observer import VeritasObserver
+from core.umbrella import UmbrellaKMS, b64_default
+from pipeline.stage2_parsing.optical_sieve import OpticalSieve
+from pipeline.stage4_veritas.veritas_observer import BatchingVeritas, VeritasObserver
+
+class TrustEngineResponse(ORJSONResponse):
+    """ORJSONResponse that base64-encodes binary fields (ciphertext, nonce) at the edge."""
+    def render(self, content: Any) -> bytes:
+        try:
+            return orjson.dumps(content, default=b64_default, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            # Values orjson cannot encode (e.g. integers wider than 64 bits in audit metadata)
+            return json.dumps(content, separators=(",", ":"), ensure_ascii=False,
+                              default=_fallback_default).encode()
+
+def _fallback_default(obj):
+    try:
+        return b64_default(obj)
+    except TypeError:
+        return str(obj)
 
 app = FastAPI(
     title="FoundLab Suite Trust Engine",
     description="Zero-Persistence Auditable Trust Infrastructure API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=TrustEngineResponse
 )
 
 app.add_middleware(
@@ -26,16 +48,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Core Services
-# Note: In a production app, these might be singletons or dependency injected
-veritas = VeritasObserver()
-umbrella = UmbrellaKMS()
+# Core Services: app-level singletons, injected into endpoints via Depends
+@functools.lru_cache(maxsize=None)
+def get_veritas() -> VeritasObserver:
+    return VeritasObserver()
+
+@functools.lru_cache(maxsize=None)
+def get_veritas_batcher() -> BatchingVeritas:
+    # Concurrent /veritas/log calls within a 2 ms window share one chain commit
+    return BatchingVeritas(get_veritas())
+
+@functools.lru_cache(maxsize=None)
+def get_umbrella() -> UmbrellaKMS:
+    return UmbrellaKMS()
+
+@functools.lru_cache(maxsize=None)
+def get_sieve() -> OpticalSieve:
+    # Shares the app's Veritas/Umbrella instances; built on first use
+    return OpticalSieve(veritas=get_veritas(), umbrella=get_umbrella())
 
 class AuditLogRequest(BaseModel):
     action: str
     data_hash: str
     metadata: Optional[Dict[str, Any]] = None
 
+class AuditBatchRequest(BaseModel):
+    events: List[AuditLogRequest]
+
 class EncryptRequest(BaseModel):
     plaintext: str
 
@@ -48,39 +87,58 @@ async def root():
     }
 
 @app.get("/veritas/chain")
-async def get_audit_chain():
+async def get_audit_chain(veritas: VeritasObserver = Depends(get_veritas)):
     """
     Retrieves the full immutable audit chain (simulated).
     """
     return veritas.get_chain()
 
 @app.post("/veritas/log")
-async def log_audit_event(request: AuditLogRequest):
+async def log_audit_event(request: AuditLogRequest, batcher: BatchingVeritas = Depends(get_veritas_batcher)):
     """
     Logs an event to the Veritas Observer immutable ledger (Black-Chain).
+    Concurrent calls are batched server-side; a batched event also gets its Merkle leaf_hash.
     """
     try:
         # Commit to Veritas Black-Chain
-        # The emit_log method currently returns the lock_hash
-        lock_hash = veritas.emit_log(request.action, request.data_hash)
+        result = await batcher.emit_log(request.action, request.data_hash, request.metadata)
+        
+        return {"status": "committed", **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/veritas/log/batch")
+async def log_audit_batch(request: AuditBatchRequest, veritas: VeritasObserver = Depends(get_veritas)):
+    """
+    Logs a batch of independent events as Merkle leaves.
+    Only the batch root is chained into the Black-Chain (one link per batch).
+    """
+    if not request.events:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one event")
+    try:
+        link, leaf_hashes = veritas.emit_batch(
+            [(event.action, event.data_hash, event.metadata) for event in request.events]
+        )
         
         return {
-            "status": "committed", 
-            "lock_hash": lock_hash,
-            "chain_index": veritas._chain_index
+            "status": "committed",
+            "lock_hash": link.lock_hash,
+            "leaf_hashes": leaf_hashes,
+            "chain_index": link.index + 1
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/umbrella/encrypt")
-async def encrypt_data(request: EncryptRequest):
+async def encrypt_data(request: EncryptRequest, umbrella: UmbrellaKMS = Depends(get_umbrella)):
     """
     Encrypts sensitive data using Umbrella KMS.
     Ensures plaintext is handled only in-memory and returns ciphertext.
     """
     try:
         result = umbrella.encrypt_payload(request.plaintext)
-        return result
+        # Returned as a Response so the raw ciphertext bytes skip jsonable_encoder
+        return TrustEngineResponse(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
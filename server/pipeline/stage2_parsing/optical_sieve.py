@@ -2,12 +2,24 @@ from abc import ABC, abstractmethod
 import numpy as np
 import cv2
 import pytesseract
+import datetime
+import orjson
 import sys
 import os
 from pathlib import Path
-from core.umbrella import UmbrellaKMS
+from core.umbrella import UmbrellaKMS, b64_default, shred_buffer
 from pipeline.stage4_veritas.veritas_observer import VeritasObserver
-import gc
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import itertools
+import multiprocessing
+import threading
+
+try:
+    import tesserocr
+except ImportError:  # binding nativa opcional (requer libtesseract)
+    tesserocr = None
 
 class IOpticalEngine(ABC):
     """Interface para Engines de OCR (Tesseract, NVIDIA NIM, Google Vision)."""
@@ -15,78 +27,250 @@ class IOpticalEngine(ABC):
     def extract_text(self, image: np.ndarray) -> str:
         pass
 
+# Páginas chegam alinhadas e binarizadas: bloco único de texto, só o motor LSTM
+TESS_PSM = 6
+TESS_OEM = 1
+
 class TesseractEngine(IOpticalEngine):
+    # Limite (s) por página para o processo do tesseract
+    TIMEOUT_S = 10
+
     def __init__(self):
         self.tessdata_path = self._get_tessdata_directory_path()
+        # Config montada uma vez, não a cada página
+        self.tess_config = rf'--tessdata-dir "{self.tessdata_path}" ' if self.tessdata_path else ''
+        # --psm 6: Assume a single uniform block of text (pula a análise de layout)
+        # --oem 1: LSTM only
+        self.tess_config += f'--psm {TESS_PSM} --oem {TESS_OEM}'
     
-    def _get_tessdata_directory_path(self):
+    @staticmethod
+    def _get_tessdata_directory_path():
         env_root = Path(sys.executable).parent.parent
         share_dir = os.path.join(env_root, "share", "tessdata")
         if not os.path.exists(share_dir): return None
         return str(share_dir)
 
     def extract_text(self, image: np.ndarray) -> str:
-        tess_config = rf'--tessdata-dir "{self.tessdata_path}"' if self.tessdata_path else ''
-        # Improve OCR accuracy with PSM and OEM modes
-        # --psm 3: Fully automatic page segmentation, but no OSD. (Default)
-        # --oem 3: Default OCR Engine Mode
-        tess_config += ' --psm 3 --oem 3'
-        return pytesseract.image_to_string(image, config=tess_config)
+        return pytesseract.image_to_string(image, config=self.tess_config, timeout=self.TIMEOUT_S)
+
+class TesserocrEngine(IOpticalEngine):
+    """
+    Chama a libtesseract in-process via tesserocr: sem fork/exec do binário
+    e sem PNG temporário. Os pixels do array são entregues direto à API.
+    """
+    def __init__(self, psm=TESS_PSM):
+        tessdata_path = TesseractEngine._get_tessdata_directory_path()
+        kwargs = {"path": tessdata_path} if tessdata_path else {}
+        self._api = tesserocr.PyTessBaseAPI(
+            psm=psm,
+            oem=TESS_OEM,
+            **kwargs
+        )
+        # PyTessBaseAPI não é reentrante
+        self._lock = threading.Lock()
+
+    def extract_text(self, image: np.ndarray) -> str:
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+        with self._lock:
+            self._api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, image.strides[0])
+            return self._api.GetUTF8Text()
+
+@functools.lru_cache(maxsize=None)
+def default_engine() -> IOpticalEngine:
+    """
+    Prefere a binding in-process quando instalada; senão usa o CLI via pytesseract.
+    Singleton por processo: a descoberta do tessdata roda uma única vez.
+    """
+    return TesserocrEngine() if tesserocr is not None else TesseractEngine()
+
+# Limite de páginas processadas por documento
+MAX_PAGES = 3
+
+# Pool de processos compartilhado (criado uma vez, sob demanda). Cada worker mantém
+# seu próprio OpticalSieve sequencial, com engine e buffers locais ao processo.
+_page_executor = None
+_page_executor_lock = threading.Lock()
+_worker_sieve = None
+
+def _init_page_worker():
+    global _worker_sieve
+    _worker_sieve = OpticalSieve(parallel=False)
+
+class PageProcessingError(RuntimeError):
+    """Falha de OCR num worker, repassada ao processo pai de forma picklable."""
+
+def _process_one_page(img_array: np.ndarray) -> str:
+    try:
+        return _worker_sieve._extract_page(img_array)
+    except Exception as e:
+        # Exceções como pytesseract.TesseractNotFoundError não são reconstruíveis
+        # no processo pai e quebrariam o pool inteiro (BrokenProcessPool).
+        raise PageProcessingError(f"{type(e).__name__}: {e}") from None
+
+def _get_page_executor() -> ProcessPoolExecutor:
+    global _page_executor
+    with _page_executor_lock:
+        if _page_executor is None:
+            # spawn: não herda o thread do listener de log da Veritas via fork
+            _page_executor = ProcessPoolExecutor(
+                max_workers=min(MAX_PAGES, os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_page_worker,
+            )
+        return _page_executor
+
+def _discard_page_executor(executor: ProcessPoolExecutor):
+    """Descarta um pool quebrado; a próxima chamada a _get_page_executor cria outro."""
+    global _page_executor
+    with _page_executor_lock:
+        if _page_executor is executor:
+            _page_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+@functools.lru_cache(maxsize=512)
+def _rotation_matrix(width: int, height: int, angle_decideg: int) -> np.ndarray:
+    """
+    Matriz de rotação por (shape, ângulo quantizado em 0.1°). Páginas do mesmo
+    scanner repetem dimensões e inclinações, então quase todas acertam o cache.
+    """
+    M = cv2.getRotationMatrix2D((width // 2, height // 2), angle_decideg / 10.0, 1.0)
+    M.setflags(write=False)  # compartilhada entre chamadas
+    return M
+
+# Fecha o espaço entre letras/palavras na cópia reduzida 4×, fundindo cada linha de texto
+_TEXT_LINE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 1))
 
 class OpticalSieve:
     """
     Processa dados visuais em ambientes de memória isolada (Zero-Persistence).
     Usa Strategy Pattern para trocar a engine de OCR.
+    Com a engine padrão, as páginas são processadas em paralelo num pool de
+    processos; uma engine injetada roda in-process (pode não ser picklable).
     """
-    def __init__(self, engine: IOpticalEngine = None):
-        self.veritas = VeritasObserver()
-        self.umbrella = UmbrellaKMS()
-        self.engine = engine if engine else TesseractEngine()
+    def __init__(self, engine: IOpticalEngine = None, parallel: bool = True,
+                 veritas: VeritasObserver = None, umbrella: UmbrellaKMS = None):
+        self.veritas = veritas if veritas else VeritasObserver()
+        self.umbrella = umbrella if umbrella else UmbrellaKMS()
+        self._parallel = parallel and engine is None
+        # Em modo paralelo o OCR roda só nos workers: o pai não carrega modelo algum
+        self.engine = engine if engine else (None if self._parallel else default_engine())
+        # Buffers reaproveitados entre páginas de mesmo shape (evita um Mat novo por etapa).
+        # O retorno de _deskew aponta para warp_dst: consumir antes da próxima página.
+        # Locais ao thread: o sieve é singleton da app e handlers sync rodam em threadpool.
+        self._buffers = threading.local()
+
+    def _buffers_for(self, image):
+        buffers = self._buffers
+        if getattr(buffers, "shape", None) != image.shape:
+            buffers.gray = np.empty(image.shape[:2], dtype=np.uint8)
+            buffers.warp_dst = np.empty_like(image)
+            buffers.bin = np.empty(image.shape[:2], dtype=np.uint8)
+            buffers.shape = image.shape
+        return buffers.gray, buffers.warp_dst, buffers.bin
+
+    @staticmethod
+    def _hough_skew_angle(gray):
+        """
+        Estima a inclinação pela mediana das linhas de Hough sobre as linhas de base
+        de uma cópia reduzida 4×. O fechamento horizontal funde cada linha de texto
+        num blob; só a borda inferior de cada blob vota, então mesmo linhas curtas em
+        fonte de corpo formam picos nítidos e blocos de texto densos não geram
+        diagonais espúrias. Retorna None se nenhuma linha de texto for encontrada.
+        """
+        small = cv2.resize(gray, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA)
+        if small.shape[0] < 2 or small.shape[1] < 12:
+            return None  # pequena demais para bordas de linha ou limiar de votos > 0: usa minAreaRect
+        _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, _TEXT_LINE_KERNEL)
+        baselines = np.zeros_like(binary)
+        cv2.bitwise_and(binary[:-1], cv2.bitwise_not(binary[1:]), dst=baselines[:-1])
+        # Limiar de votos ~ linha de texto curta (~1/12 da largura); θ restrito ao texto quase horizontal.
+        lines = cv2.HoughLines(baselines, 1, np.pi / 720, threshold=small.shape[1] // 12,
+                               min_theta=np.pi / 4, max_theta=3 * np.pi / 4)
+        if lines is None:
+            return None
+        # HoughLines ordena por votos: mediana das 50 linhas mais fortes.
+        theta = lines.reshape(-1, 2)[:50, 1]
+        return float(np.median(np.degrees(theta))) - 90
 
     def _deskew(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        gray = cv2.bitwise_not(gray)
-        coords = np.column_stack(np.where(gray > 0))
-        angle = cv2.minAreaRect(coords)[-1]
-        angle = -(90 + angle) if angle < -45 else -angle
-        center = (image.shape[1] // 2, image.shape[0] // 2)
-        M = cv2.getRotationMatrix2D(center, angle, 1.0)
-        return cv2.warpAffine(image, M, (image.shape[1], image.shape[0]), flags=cv2.INTER_CUBIC)
+        gray, warp_dst, _ = self._buffers_for(image)
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+        cv2.bitwise_not(gray, dst=gray)
+        angle = self._hough_skew_angle(gray)
+        if angle is None:
+            # Página esparsa, sem linhas detectáveis: recorre ao minAreaRect do foreground.
+            # findNonZero devolve (x, y) em int32; invertido para (y, x), a mesma
+            # convenção de np.where, preservando a semântica do ângulo abaixo.
+            points = cv2.findNonZero(gray)
+            if points is None:
+                return image  # página em branco: nada a alinhar
+            coords = np.ascontiguousarray(points.reshape(-1, 2)[:, ::-1])
+            angle = cv2.minAreaRect(coords)[-1]
+            angle = -(90 + angle) if angle < -45 else -angle
+        M = _rotation_matrix(image.shape[1], image.shape[0], round(angle * 10))
+        return cv2.warpAffine(image, M, (image.shape[1], image.shape[0]), dst=warp_dst, flags=cv2.INTER_CUBIC)
+
+    def _binarize(self, image):
+        # Entrada binarizada poupa o Otsu interno do Tesseract e reduz o espaço de hipóteses.
+        # Chamado após _deskew: reaproveita gray (já consumido) e grava em bin.
+        gray, _, binary = self._buffers_for(image)
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15, dst=binary
+        )
+
+    def _extract_page(self, img_array: np.ndarray) -> str:
+        deskewed = self._deskew(img_array)
+        binary = self._binarize(deskewed)
+        # Usa a Engine injetada
+        return self.engine.extract_text(binary)
+
+    @staticmethod
+    def _map_pages_in_pool(page_arrays):
+        executor = _get_page_executor()
+        try:
+            return list(executor.map(_process_one_page, page_arrays))
+        except BrokenProcessPool:
+            # Worker morto (OOM, crash nativo): o pool não se recupera sozinho
+            _discard_page_executor(executor)
+            raise
 
     def process_securely(self, pages) -> str:
-        raw_plaintext = None
-        full_text = []
+        raw_plaintext = bytearray()
         
         try:
-            for p, page in enumerate(pages):
-                if p >= 3: break
-                
-                img_array = np.array(page)
-                deskewed = self._deskew(img_array)
-                
-                # Usa a Engine injetada
-                text = self.engine.extract_text(deskewed)
-                full_text.append(text)
-                
-                del img_array
-                del deskewed
+            page_arrays = [np.array(page) for page in itertools.islice(pages, MAX_PAGES)]
+            
+            # Páginas são independentes; map preserva a ordem original
+            if self._parallel:
+                texts = self._map_pages_in_pool(page_arrays)
+            else:
+                texts = map(self._extract_page, page_arrays)
+            chunks = [text.encode('utf-8') for text in texts]
             
-            raw_plaintext = " ".join(full_text)
+            # Plaintext num único buffer pré-alocado com os separadores já no lugar: sem join
+            # intermediário nem realocações. Só este buffer é zerado após a cifragem; os textos
+            # por página e suas cópias em `chunks` são imutáveis e não podem ser zerados.
+            size = sum(len(chunk) for chunk in chunks) + max(len(chunks) - 1, 0)
+            raw_plaintext = bytearray(b" " * size)
+            offset = 0
+            for chunk in chunks:
+                raw_plaintext[offset:offset + len(chunk)] = chunk
+                offset += len(chunk) + 1
             
             encrypted_package = self.umbrella.encrypt_payload(raw_plaintext)
             
-            import hashlib
-            audit_hash = hashlib.sha256(encrypted_package['ciphertext'].encode()).hexdigest()
-            trace_id = self.veritas.emit_log("DOCUMENT_DIGITIZATION", audit_hash)
+            trace_id = self.veritas.emit_log("DOCUMENT_DIGITIZATION", encrypted_package['audit_hash'])
 
-            import json
-            import datetime
-            result = json.dumps({
+            result = orjson.dumps({
                 "trace_id": trace_id,
                 "umbrella_ref": encrypted_package,
                 "status": "SECURE_ARCHIVED",
                 "timestamp": datetime.datetime.now().isoformat()
-            })
+            }, default=b64_default).decode()
 
             return result
 
@@ -94,6 +278,4 @@ class OpticalSieve:
             self.veritas.emit_log("SECURITY_EXCEPTION", str(e))
             raise e
         finally:
-            if raw_plaintext is not None: del raw_plaintext
-            if 'full_text' in locals(): del full_text
-            gc.collect()
+            shred_buffer(raw_plaintext)
@@ -1,7 +1,91 @@
+from collections import deque
 from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from logging.handlers import QueueHandler, QueueListener
+import asyncio
+import atexit
 import hashlib
 import datetime
 import json
+import logging
+import queue
+import sys
+import threading
+import time
+import orjson
+
+logger = logging.getLogger("veritas")
+
+
+class _LinkFormatter(logging.Formatter):
+    """Serializa o link no thread do listener, fora do caminho da requisição."""
+    def format(self, record: logging.LogRecord) -> str:
+        return f"[VERITAS BLACK-CHAIN]: {_dumps(record.link).decode()}"
+
+
+class _BoundedQueueHandler(QueueHandler):
+    """
+    Com a fila cheia, espera até PUT_TIMEOUT_S pelo listener antes de descartar a linha.
+    O histórico em memória é limitado, então cada descarte é contado e avisado direto
+    no stderr (fora da fila), com índice e LockHash do link.
+    """
+    PUT_TIMEOUT_S = 0.05
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put(record, timeout=self.PUT_TIMEOUT_S)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+                dropped = self.dropped
+            link = getattr(record, "link", {})
+            sys.stderr.write(
+                f"[VERITAS WARNING]: fila de log cheia; link {link.get('index')} "
+                f"({link.get('lock_hash')}) fora do log ({dropped} descartados)\n"
+            )
+
+
+def _start_log_listener(maxsize: int = 10000) -> QueueListener:
+    log_queue = queue.Queue(maxsize=maxsize)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(_LinkFormatter())
+    listener = QueueListener(log_queue, stream)
+    logger.addHandler(_BoundedQueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+_listener = _start_log_listener()
+
+# Separação de domínio da Merkle Tree (RFC 6962): folha e nó interno nunca colidem
+_LEAF_PREFIX = b"\x00"
+_NODE_PREFIX = b"\x01"
+
+def _length_prefixed(data: bytes) -> bytes:
+    """Campo com prefixo de tamanho (4 bytes big-endian): ("A","h1") != ("Ah","1")."""
+    return len(data).to_bytes(4, 'big') + data
+
+def _dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """
+    orjson no caminho comum; o que ele não codifica (inteiros além de 64 bits, tipos
+    arbitrários) cai no json da stdlib, com a mesma forma compacta e str() como fallback.
+    """
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+    except TypeError:
+        return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"),
+                          ensure_ascii=False, default=str).encode()
+
+def _canonical_metadata(metadata: Optional[Dict[str, Any]]) -> bytes:
+    return _dumps(metadata, sort_keys=True)
 
 @dataclass
 class BlackChainLink:
@@ -10,12 +94,15 @@ class BlackChainLink:
     Cada link contém o hash do link anterior, garantindo imutabilidade.
     """
     index: int
-    timestamp: str
+    timestamp: str  # ISO 8601, forma publicada
+    timestamp_ns: int  # time.time_ns(); é o valor que entra no LockHash
     actor_hash: str
     action_type: str
     artifact_signature: str
     previous_hash: str
     lock_hash: str  # Hash deste bloco (Current Hash)
+    metadata: Optional[Dict[str, Any]] = None  # entra no LockHash quando presente
+    events: Optional[List[Dict[str, Any]]] = None  # folhas de um BATCH_COMMIT
 
 class VeritasObserver:
     """
@@ -24,44 +111,179 @@ class VeritasObserver:
     Ref: Umbrella/Pilares Centrais/Protocolo Veritas
     """
     
+    # Ator fixo do worker, pré-codificado uma única vez
+    _ACTOR = "SYSTEM_OCR_WORKER"
+    _ACTOR_BYTES = _ACTOR.encode()
+
     # Simulação de Estado da Cadeia (Em produção, viria do BigQuery/Ledger)
-    _chain_tip_hash = "0000000000000000000000000000000000000000000000000000000000000000"
+    # O tip é mantido como digest bruto (32 bytes) para o encadeamento; a forma
+    # hex só existe no registro publicado.
+    _chain_tip_digest = bytes(32)
+    _chain_tip_hash = _chain_tip_digest.hex()
     _chain_index = 0
-    _chain_history = []
+    # Histórico em memória limitado; o índice continua crescendo além do limite.
+    _chain_history = deque(maxlen=10000)
+    # Único ponto de serialização: leitura do tip + append são atômicos.
+    _lock = threading.Lock()
 
     def get_chain(self):
-        return VeritasObserver._chain_history
+        with VeritasObserver._lock:
+            return list(VeritasObserver._chain_history)
+
+    def emit_log(self, action: str, data_hash: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        # Retorna o LockHash como Trace ID
+        return self.emit_link(action, data_hash, metadata).lock_hash
+
+    def emit_link(self, action: str, data_hash: str, metadata: Optional[Dict[str, Any]] = None,
+                  events: Optional[List[Dict[str, Any]]] = None) -> BlackChainLink:
+        """Como emit_log, mas retorna o link registrado (índice e LockHash consistentes)."""
+        link = self._append(action, data_hash, metadata, events)
+        
+        # 6. Emitir Log Estruturado (apenas enfileira; o listener serializa e escreve)
+        logger.info("veritas", extra={"link": link.__dict__})
+        return link
 
-    def emit_log(self, action: str, data_hash: str) -> str:
-        # 1. Calcular Timestamp
-        ts = datetime.datetime.now().isoformat()
+    def emit_batch(self, events: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> Tuple[BlackChainLink, List[str]]:
+        """
+        Registra eventos independentes (action, data_hash, metadata) como folhas
+        de uma Merkle Tree. Apenas a raiz entra na cadeia sequencial (um único
+        link por lote); os eventos e suas folhas ficam registrados no link.
+        Retorna o link do BATCH_COMMIT e o hash de cada folha.
+        """
+        if not events:
+            raise ValueError("Lote vazio não pode ser registrado na Black-Chain.")
         
-        # 2. Recuperar Hash Anterior (Previous Block Hash)
-        prev_hash = VeritasObserver._chain_tip_hash
+        # Folhas calculadas fora do lock: SHA256(0x00 || campos com prefixo de tamanho)
+        leaves = []
+        for action, data_hash, metadata in events:
+            h = hashlib.sha256(_LEAF_PREFIX)
+            h.update(_length_prefixed(VeritasObserver._ACTOR_BYTES))
+            h.update(_length_prefixed(action.encode()))
+            h.update(_length_prefixed(data_hash.encode()))
+            h.update(_length_prefixed(_canonical_metadata(metadata)))
+            leaves.append(h.digest())
         
-        # 3. Construir Payload para Hashing (LockHash)
-        # LockHash = SHA256(Index + Timestamp + Actor + Action + Artifact + PrevHash)
-        payload_to_hash = f"{VeritasObserver._chain_index}{ts}SYSTEM_OCR_WORKER{action}{data_hash}{prev_hash}"
-        lock_hash = hashlib.sha256(payload_to_hash.encode()).hexdigest()
+        # Redução par a par: SHA256(0x01 || esq || dir). Em níveis ímpares o último
+        # nó é promovido sem duplicação, então [e1,e2,e3] != [e1,e2,e3,e3].
+        level = leaves
+        while len(level) > 1:
+            promoted = [level[-1]] if len(level) % 2 else []
+            level = [
+                hashlib.sha256(_NODE_PREFIX + level[i] + level[i + 1]).digest()
+                for i in range(0, len(level) - 1, 2)
+            ] + promoted
         
-        # 4. Criar o Link
-        link = BlackChainLink(
-            index=VeritasObserver._chain_index,
-            timestamp=ts,
-            actor_hash="SYSTEM_OCR_WORKER",
-            action_type=action,
-            artifact_signature=data_hash,
-            previous_hash=prev_hash,
-            lock_hash=lock_hash
-        )
+        leaf_hashes = [leaf.hex() for leaf in leaves]
+        records = [
+            {"action_type": action, "artifact_signature": data_hash, "metadata": metadata, "leaf_hash": leaf}
+            for (action, data_hash, metadata), leaf in zip(events, leaf_hashes)
+        ]
+        link = self.emit_link("BATCH_COMMIT", level[0].hex(), events=records)
+        return link, leaf_hashes
+
+    def _append(self, action: str, data_hash: str, metadata: Optional[Dict[str, Any]] = None,
+                events: Optional[List[Dict[str, Any]]] = None) -> BlackChainLink:
+        with VeritasObserver._lock:
+            # 1. Calcular Timestamp (dentro do lock: segue a ordem de append)
+            ts_ns = time.time_ns()
+            
+            # 2. Recuperar Hash Anterior (Previous Block Hash)
+            index = VeritasObserver._chain_index
+            prev_digest = VeritasObserver._chain_tip_digest
+            prev_hash = VeritasObserver._chain_tip_hash
+            
+            # 3. Construir Payload para Hashing (LockHash)
+            # LockHash = SHA256(Index + Timestamp + Actor + Action + Artifact + PrevDigest [+ Metadata])
+            # Num BATCH_COMMIT, Artifact é a raiz Merkle, que já cobre os eventos.
+            # Cada campo é alimentado direto no SHA-256, sem montar a string fundida.
+            h = hashlib.sha256()
+            h.update(str(index).encode())
+            h.update(ts_ns.to_bytes(8, 'big'))
+            h.update(VeritasObserver._ACTOR_BYTES)
+            h.update(action.encode())
+            h.update(data_hash.encode())
+            h.update(prev_digest)
+            if metadata is not None:
+                h.update(_length_prefixed(_canonical_metadata(metadata)))
+            lock_digest = h.digest()
+            lock_hash = lock_digest.hex()
+            
+            # 4. Criar o Link
+            link = BlackChainLink(
+                index=index,
+                timestamp=datetime.datetime.fromtimestamp(ts_ns / 1e9).isoformat(),
+                timestamp_ns=ts_ns,
+                actor_hash=VeritasObserver._ACTOR,
+                action_type=action,
+                artifact_signature=data_hash,
+                previous_hash=prev_hash,
+                lock_hash=lock_hash,
+                metadata=metadata,
+                events=events
+            )
+            
+            # 5. Atualizar Estado da Cadeia (Simulado)
+            VeritasObserver._chain_tip_digest = lock_digest
+            VeritasObserver._chain_tip_hash = lock_hash
+            VeritasObserver._chain_index = index + 1
+            VeritasObserver._chain_history.append(link.__dict__)
         
-        # 5. Atualizar Estado da Cadeia (Simulado)
-        VeritasObserver._chain_tip_hash = lock_hash
-        VeritasObserver._chain_index += 1
-        VeritasObserver._chain_history.append(link.__dict__)
+        return link
+
+
+class BatchingVeritas:
+    """
+    Agrupa chamadas concorrentes de emit_log numa janela curta (padrão 2 ms).
+    Um evento isolado na janela vira um link comum; dois ou mais viram folhas de
+    um único BATCH_COMMIT, com uma só passagem pelo lock da cadeia.
+    Deve ser usado a partir de um único event loop (o do servidor).
+    """
+    def __init__(self, observer: VeritasObserver, window_s: float = 0.002, max_batch: int = 256):
+        self._observer = observer
+        self._window_s = window_s
+        self._max_batch = max_batch
+        self._pending = []
+        self._flush_handle = None
+
+    async def emit_log(self, action: str, data_hash: str,
+                       metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        # Metadata canonizada já na entrada: um valor inválido falha só este chamador,
+        # não o lote inteiro da janela.
+        _canonical_metadata(metadata)
+        future = loop.create_future()
+        self._pending.append(((action, data_hash, metadata), future))
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window_s, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
         
-        # 6. Emitir Log Estruturado
-        print(f"[VERITAS BLACK-CHAIN]: {json.dumps(link.__dict__)}")
+        events = [event for event, _ in pending]
+        try:
+            if len(events) == 1:
+                link = self._observer.emit_link(*events[0])
+                results = [{"lock_hash": link.lock_hash, "chain_index": link.index + 1}]
+            else:
+                link, leaf_hashes = self._observer.emit_batch(events)
+                results = [
+                    {"lock_hash": link.lock_hash, "chain_index": link.index + 1, "leaf_hash": leaf}
+                    for leaf in leaf_hashes
+                ]
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
         
-        # Retorna o LockHash como Trace ID
-        return lock_hash
+        for (_, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
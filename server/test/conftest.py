@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Mesmo ajuste de main.py: imports relativos à pasta server/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
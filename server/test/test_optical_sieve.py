@@ -0,0 +1,98 @@
+import hashlib
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+from pipeline.stage2_parsing import optical_sieve
+from pipeline.stage2_parsing.optical_sieve import IOpticalEngine, OpticalSieve, PageProcessingError
+
+
+class _UnpicklableError(Exception):
+    def __init__(self):
+        super().__init__("engine missing")
+
+
+class _FailingEngine(IOpticalEngine):
+    def extract_text(self, image: np.ndarray) -> str:
+        raise _UnpicklableError()
+
+
+def test_worker_errors_are_reraised_as_picklable(monkeypatch):
+    monkeypatch.setattr(optical_sieve, "_worker_sieve", OpticalSieve(engine=_FailingEngine()))
+    with pytest.raises(PageProcessingError) as excinfo:
+        optical_sieve._process_one_page(np.full((64, 64, 3), 255, np.uint8))
+    restored = pickle.loads(pickle.dumps(excinfo.value))
+    assert str(restored) == "_UnpicklableError: engine missing"
+
+
+def _skewed_page(angle, text="Lorem ipsum dolor sit amet"):
+    page = np.full((2200, 1700), 255, np.uint8)
+    for i in range(40):
+        cv2.putText(page, text, (120, 150 + i * 40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 1)
+    M = cv2.getRotationMatrix2D((850, 1100), angle, 1.0)
+    return cv2.bitwise_not(cv2.warpAffine(page, M, (1700, 2200), borderValue=255))
+
+
+@pytest.mark.parametrize("angle", [-8, -3, -1, 0, 2, 5, 9])
+def test_hough_skew_angle_on_body_size_text(angle):
+    estimate = OpticalSieve._hough_skew_angle(_skewed_page(angle))
+    assert estimate is not None
+    assert abs(estimate + angle) <= 1.0
+
+
+class _DigestEngine(IOpticalEngine):
+    def extract_text(self, image: np.ndarray) -> str:
+        return hashlib.sha256(image.tobytes()).hexdigest()
+
+
+def test_concurrent_pages_do_not_share_buffers():
+    sieve = OpticalSieve(engine=_DigestEngine())
+    pages = [cv2.cvtColor(_skewed_page(angle), cv2.COLOR_GRAY2BGR) for angle in (-6, -2, 3, 7)] * 4
+    expected = [sieve._extract_page(page) for page in pages]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(pool.map(sieve._extract_page, pages)) == expected
+
+
+def test_parallel_sieve_does_not_load_an_engine_in_the_parent(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(optical_sieve, "default_engine", lambda: loaded.append(1) or _DigestEngine())
+    assert OpticalSieve().engine is None
+    assert loaded == []
+    assert isinstance(OpticalSieve(parallel=False).engine, _DigestEngine)
+
+
+class _ScriptedEngine(IOpticalEngine):
+    def __init__(self, texts):
+        self._texts = iter(texts)
+
+    def extract_text(self, image: np.ndarray) -> str:
+        return next(self._texts)
+
+
+class _RecordingUmbrella:
+    def __init__(self):
+        self.plaintext = None
+
+    def encrypt_payload(self, plaintext):
+        self.plaintext = bytes(plaintext)
+        return {"key_id": "k", "nonce": b"n", "ciphertext": b"c", "audit_hash": "h", "algo": "AES-128-GCM"}
+
+
+def test_assembled_plaintext_matches_joined_page_texts():
+    texts = ["Página 1: CPF 123.456.789-00", "", "naïve — ünïcode ✓"]
+    umbrella = _RecordingUmbrella()
+    sieve = OpticalSieve(engine=_ScriptedEngine(texts), parallel=False, umbrella=umbrella)
+    pages = [np.full((64, 64, 3), 255, np.uint8) for _ in texts]
+    sieve.process_securely(pages)
+    assert umbrella.plaintext == " ".join(texts).encode("utf-8")
+
+
+@pytest.mark.parametrize("shape", [(4, 4), (5, 400), (400, 44)])
+def test_tiny_pages_fall_back_to_min_area_rect(shape):
+    page = np.full(shape + (3,), 255, np.uint8)
+    page[shape[0] // 2, :] = 0
+    assert OpticalSieve._hough_skew_angle(cv2.bitwise_not(cv2.cvtColor(page, cv2.COLOR_BGR2GRAY))) is None
+    assert OpticalSieve(engine=_DigestEngine())._deskew(page).shape == page.shape
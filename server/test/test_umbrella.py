@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from core import umbrella
+from core.umbrella import UmbrellaKMS
+
+
+def test_encrypt_payload_round_trips_and_is_not_under_a_zeroed_key(monkeypatch):
+    # Captura a DEK antes de ser zerada, para poder decifrar no teste
+    captured = []
+    real_shred = umbrella.shred_buffer
+
+    def capture_then_shred(buf):
+        captured.append(bytes(buf))
+        real_shred(buf)
+
+    monkeypatch.setattr(umbrella, "shred_buffer", capture_then_shred)
+    plaintext = "CPF 123.456.789-00 secret payload"
+
+    for _ in range(3):
+        captured.clear()
+        package = UmbrellaKMS().encrypt_payload(plaintext)
+        (key,) = [buf for buf in captured if len(buf) == 16]
+        assert key != bytes(16)
+        assert AESGCM(key).decrypt(package["nonce"], package["ciphertext"], None) == plaintext.encode()
+        with pytest.raises(InvalidTag):
+            AESGCM(bytes(16)).decrypt(package["nonce"], package["ciphertext"], None)
+
+
+def _refill_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "umbrella-dek-refill"]
+
+
+def test_instances_share_one_dek_pool_and_stop_zeroes_queued_keys():
+    for _ in range(20):
+        UmbrellaKMS().encrypt_payload("payload")
+    assert len(_refill_threads()) == 1
+
+    deadline = time.monotonic() + 5
+    while umbrella._dek_pool.qsize() < umbrella.DEK_POOL_SIZE and time.monotonic() < deadline:
+        time.sleep(0.01)
+    queued = [key for _, key in list(umbrella._dek_pool.queue)]
+    assert queued
+
+    umbrella.stop_dek_pool()
+    assert _refill_threads() == []
+    assert umbrella._dek_pool.empty()
+    assert all(key == bytes(16) for key in queued)
+
+    # O pool volta a funcionar após o stop
+    assert UmbrellaKMS().encrypt_payload("payload")["ciphertext"]
+    umbrella.stop_dek_pool()
@@ -0,0 +1,104 @@
+import asyncio
+import datetime
+import logging
+import queue
+
+from pipeline.stage4_veritas.veritas_observer import BatchingVeritas, VeritasObserver, _BoundedQueueHandler
+
+
+def _batch_root(veritas, events):
+    link, _ = veritas.emit_batch(events)
+    return link.artifact_signature
+
+
+def test_odd_leaf_is_promoted_not_duplicated():
+    veritas = VeritasObserver()
+    e1, e2, e3 = ("A", "h1", None), ("B", "h2", None), ("C", "h3", None)
+    assert _batch_root(veritas, [e1, e2, e3]) != _batch_root(veritas, [e1, e2, e3, e3])
+
+
+def test_leaf_fields_are_length_prefixed():
+    veritas = VeritasObserver()
+    _, leaves = veritas.emit_batch([("A", "h1", None), ("Ah", "1", None)])
+    assert leaves[0] != leaves[1]
+
+
+def test_batch_events_and_metadata_reach_the_chain():
+    veritas = VeritasObserver()
+    committed, leaves = veritas.emit_batch([("A", "h1", {"type": "USER_ACTION"}), ("B", "h2", None)])
+    link = veritas.get_chain()[-1]
+    assert link["lock_hash"] == committed.lock_hash
+    assert link["index"] == committed.index
+    assert [event["action_type"] for event in link["events"]] == ["A", "B"]
+    assert link["events"][0]["metadata"] == {"type": "USER_ACTION"}
+    assert [event["leaf_hash"] for event in link["events"]] == leaves
+
+
+def test_batching_veritas_shares_one_link_across_concurrent_calls():
+    veritas = VeritasObserver()
+    batcher = BatchingVeritas(veritas, window_s=0.01)
+
+    async def run():
+        return await asyncio.gather(*(batcher.emit_log("A", f"h{i}") for i in range(3)))
+
+    results = asyncio.run(run())
+    assert len({result["lock_hash"] for result in results}) == 1
+    assert len({result["leaf_hash"] for result in results}) == 3
+    assert veritas.get_chain()[-1]["action_type"] == "BATCH_COMMIT"
+
+
+def test_batching_veritas_single_event_is_a_plain_link():
+    veritas = VeritasObserver()
+    result = asyncio.run(BatchingVeritas(veritas).emit_log("A", "h1", {"k": 1}))
+    link = veritas.get_chain()[-1]
+    assert "leaf_hash" not in result
+    assert link["lock_hash"] == result["lock_hash"]
+    assert link["action_type"] == "A" and link["metadata"] == {"k": 1}
+
+
+def test_full_log_queue_counts_and_reports_dropped_links(capsys):
+    log_queue = queue.Queue(maxsize=1)
+    handler = _BoundedQueueHandler(log_queue)
+    handler.PUT_TIMEOUT_S = 0.001
+    for index in range(3):
+        record = logging.LogRecord("veritas", logging.INFO, __file__, 0, "veritas", None, None)
+        record.link = {"index": index, "lock_hash": f"h{index}"}
+        handler.enqueue(record)
+    assert log_queue.qsize() == 1
+    assert handler.dropped == 2
+    err = capsys.readouterr().err
+    assert "link 1 (h1)" in err and "link 2 (h2)" in err
+
+
+def test_metadata_wider_than_64_bits_is_committed():
+    veritas = VeritasObserver()
+    veritas.emit_log("A", "h1", {"n": 2**70})
+    assert veritas.get_chain()[-1]["metadata"] == {"n": 2**70}
+
+
+def test_batching_veritas_fails_only_the_caller_with_bad_metadata():
+    veritas = VeritasObserver()
+    batcher = BatchingVeritas(veritas, window_s=0.01)
+
+    async def run():
+        # Chaves de tipos mistos não ordenam: nem orjson nem json conseguem canonizar
+        return await asyncio.gather(
+            batcher.emit_log("good", "h1"),
+            batcher.emit_log("big", "h2", {"n": 2**70}),
+            batcher.emit_log("bad", "h3", {"n": {1: "x", "a": "y"}}),
+            return_exceptions=True,
+        )
+
+    good, big, bad = asyncio.run(run())
+    assert isinstance(bad, TypeError)
+    assert good["lock_hash"] == big["lock_hash"]
+    assert [event["action_type"] for event in veritas.get_chain()[-1]["events"]] == ["good", "big"]
+
+
+def test_links_keep_the_iso_timestamp_next_to_timestamp_ns():
+    veritas = VeritasObserver()
+    veritas.emit_log("A", "h1")
+    link = veritas.get_chain()[-1]
+    assert datetime.datetime.fromisoformat(link["timestamp"]) == datetime.datetime.fromtimestamp(
+        link["timestamp_ns"] / 1e9
+    )